@@ -1,6 +1,7 @@
 from fastapi import APIRouter, HTTPException, Depends, Query
+from elasticsearch import AsyncElasticsearch
 from app.models.search import SearchQuery, SearchResponse
-from app.services.elasticsearch import search, check_connection
+from app.services.elasticsearch import search, check_connection, clear_search_cache, get_es
 import logging
 from typing import Dict, Any, Optional
 
@@ -10,11 +11,17 @@ logger = logging.getLogger(__name__)
 @router.get("/health")
 async def health_check():
     """Check if the API and Elasticsearch are healthy"""
-    es_health = check_connection()  # Removed await
+    es_health = await check_connection()
     return {"status": "ok", "elasticsearch": es_health}
 
+@router.post("/cache/clear")
+async def clear_cache_endpoint():
+    """Clear the in-process search result cache (ops endpoint)"""
+    cleared = clear_search_cache()
+    return {"status": "ok", "cleared": cleared}
+
 @router.post("/search")
-async def search_endpoint(request: Dict[str, Any]):
+async def search_endpoint(request: Dict[str, Any], es: AsyncElasticsearch = Depends(get_es)):
     """Search the Elasticsearch index"""
     try:
         # Create SearchQuery from request body
@@ -24,10 +31,12 @@ async def search_endpoint(request: Dict[str, Any]):
             page_size=request.get("page_size", 10),
             filter_by=request.get("filter_by"),
             sort_by=request.get("sort_by"),
-            sort_order=request.get("sort_order", "desc")
+            sort_order=request.get("sort_order", "desc"),
+            cursor=request.get("cursor")
         )
-        result = search(query)  # Removed await
-        return result.dict()
+        return await search(query, es)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Search error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
@@ -38,7 +47,9 @@ async def search_get_endpoint(
     page: int = Query(1, ge=1, description="Page number"),
     page_size: int = Query(10, ge=1, le=100, description="Results per page"),
     sort_by: Optional[str] = Query(None, description="Field to sort by"),
-    sort_order: str = Query("desc", description="Sort order (asc or desc)")
+    sort_order: str = Query("desc", description="Sort order (asc or desc)"),
+    cursor: Optional[str] = Query(None, description="Opaque cursor for deep pagination"),
+    es: AsyncElasticsearch = Depends(get_es)
 ):
     """Search endpoint for GET requests"""
     try:
@@ -48,10 +59,12 @@ async def search_get_endpoint(
             page=page,
             page_size=page_size,
             sort_by=sort_by,
-            sort_order=sort_order
+            sort_order=sort_order,
+            cursor=cursor
         )
-        result = search(search_query)  # Removed await
-        return result.dict()
+        return await search(search_query, es)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Search error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
\ No newline at end of file
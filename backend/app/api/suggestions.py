@@ -1,6 +1,8 @@
-from fastapi import APIRouter, Query, HTTPException
+from fastapi import APIRouter, Query, HTTPException, Depends
+from elasticsearch import AsyncElasticsearch
 from app.models.suggestions import SuggestionQuery, SuggestionResponse
 from app.services.suggestions import get_suggestions
+from app.services.elasticsearch import get_es
 import logging
 
 router = APIRouter(prefix="/api", tags=["suggestions"])
@@ -9,7 +11,8 @@ logger = logging.getLogger(__name__)
 @router.get("/suggest", response_model=SuggestionResponse)
 async def suggestions_endpoint(
     query: str = Query(..., description="Query prefix to get suggestions for"),
-    max_suggestions: int = Query(10, ge=1, le=20, description="Maximum number of suggestions to return")
+    max_suggestions: int = Query(10, ge=1, le=20, description="Maximum number of suggestions to return"),
+    es: AsyncElasticsearch = Depends(get_es)
 ):
     """Get search suggestions based on user input"""
     try:
@@ -17,7 +20,7 @@ async def suggestions_endpoint(
             query=query,
             max_suggestions=max_suggestions
         )
-        result = await get_suggestions(suggestion_query)
+        result = await get_suggestions(suggestion_query, es)
         return result
     except Exception as e:
         logger.error(f"Suggestions error: {str(e)}")
@@ -1,5 +1,5 @@
 import os
-from typing import List
+from typing import FrozenSet, List
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -27,7 +27,11 @@ class Settings:
     es_user: str = os.getenv("ES_USER", "")
     es_apikey: str = os.getenv("ES_APIKEY", "")
     es_index: str = os.getenv("ES_INDEX", "wiki_articles")
-    cors_origins: List[str] = parse_cors_origins()
+    # Optional shared cache (e.g. Upstash); empty string disables it
+    redis_url: str = os.getenv("REDIS_URL", "")
+    # frozenset: origin membership is checked on every request, so make
+    # the lookup O(1) instead of scanning a list
+    cors_origins: FrozenSet[str] = frozenset(parse_cors_origins())
 
 # Create settings instance
 settings = Settings()
\ No newline at end of file
@@ -1,78 +1,60 @@
 # filename: app/models/search.py
-from typing import List, Optional, Dict, Any, TypedDict
+from pydantic import BaseModel, field_validator
+from typing import List, Optional, Dict, Any
 
-# Simple dataclasses using regular Python dict/TypedDict instead of Pydantic
+# Pydantic v2 models: the validator core runs in Rust, so request
+# validation no longer costs per-field Python work. Result items on the
+# hot path are built as plain dicts in the search service; these models
+# document the response shape and validate incoming queries.
 
-class SearchQuery:
-    def __init__(self, query: str, page: int = 1, page_size: int = 10, 
-                 filter_by: Optional[Dict[str, Any]] = None, 
-                 sort_by: Optional[str] = None, 
-                 sort_order: str = "desc"):
-        self.query = query
-        # Validate parameters
-        if page < 1:
-            page = 1
-        if page_size < 1:
-            page_size = 1
-        if page_size > 100:
-            page_size = 100
-        self.page = page
-        self.page_size = page_size
-        self.filter_by = filter_by
-        self.sort_by = sort_by
-        self.sort_order = sort_order if sort_order in ["asc", "desc"] else "desc"
+class SearchQuery(BaseModel):
+    query: str
+    page: int = 1
+    page_size: int = 10
+    filter_by: Optional[Dict[str, Any]] = None
+    sort_by: Optional[str] = None
+    sort_order: str = "desc"
+    # Opaque deep-pagination cursor (base64 of [pit_id, sort_values]);
+    # decoded by the search service into the two fields below
+    cursor: Optional[str] = None
+    pit_id: Optional[str] = None
+    search_after: Optional[List[Any]] = None
 
-class SearchHighlight:
-    def __init__(self, title: Optional[List[str]] = None, text: Optional[List[str]] = None):
-        self.title = title
-        self.text = text
-        
-    def dict(self):
-        return {"title": self.title, "text": self.text}
+    @field_validator("page")
+    @classmethod
+    def _clamp_page(cls, v: int) -> int:
+        return max(v, 1)
 
-class SearchResultItem:
-    def __init__(self, id: str, title: str, text: str, score: float, 
-                 contributor: Optional[str] = None, timestamp: Optional[str] = None, 
-                 highlights: Optional[SearchHighlight] = None, url: str = ""):
-        self.id = id
-        self.title = title
-        self.text = text  # This will be used as description in the frontend
-        self.contributor = contributor
-        self.timestamp = timestamp  # This will be mapped to createdAt in frontend
-        self.score = score
-        self.highlights = highlights
-        self.url = url
-        
-    def dict(self):
-        result = {
-            "id": self.id,
-            "title": self.title, 
-            "text": self.text,
-            "description": self.text,  # Adding description to match frontend expectations
-            "contributor": self.contributor,
-            "timestamp": self.timestamp,
-            "createdAt": self.timestamp,  # Mapping timestamp to createdAt
-            "score": self.score,
-            "url": self.url
-        }
-        if self.highlights:
-            result["highlights"] = self.highlights.dict()
-        return result
+    @field_validator("page_size")
+    @classmethod
+    def _clamp_page_size(cls, v: int) -> int:
+        return min(max(v, 1), 100)
 
-class SearchResponse:
-    def __init__(self, total: int, page: int, page_size: int, results: List[SearchResultItem], 
-                 suggest: Optional[List[str]] = None):
-        self.total = total
-        self.page = page
-        self.page_size = page_size
-        self.results = results
-        self.suggest = suggest
-        
-    def dict(self):
-        return {
-            "total": self.total,
-            "page": self.page,
-            "page_size": self.page_size,
-            "results": [result.dict() for result in self.results],
-            "suggest": self.suggest
-        }
\ No newline at end of file
+    @field_validator("sort_order")
+    @classmethod
+    def _normalize_sort_order(cls, v: str) -> str:
+        return v if v in ("asc", "desc") else "desc"
+
+class SearchHighlight(BaseModel):
+    title: Optional[List[str]] = None
+    text: Optional[List[str]] = None
+
+class SearchResultItem(BaseModel):
+    id: str
+    title: str
+    text: str  # This will be used as description in the frontend
+    description: str = ""
+    contributor: Optional[str] = None
+    timestamp: Optional[str] = None  # Mapped to createdAt in the frontend
+    createdAt: Optional[str] = None
+    score: float
+    highlights: Optional[SearchHighlight] = None
+    url: str = ""
+
+class SearchResponse(BaseModel):
+    total: int
+    page: int
+    page_size: int
+    results: List[SearchResultItem]
+    suggest: Optional[List[str]] = None
+    next_cursor: Optional[str] = None
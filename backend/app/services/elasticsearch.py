@@ -1,47 +1,131 @@
-from elasticsearch import Elasticsearch, ApiError, TransportError
+from elasticsearch import AsyncElasticsearch, ApiError, TransportError
+from fastapi import HTTPException, Request
+from cachetools import TTLCache
 from app.config import settings
-from app.models.search import SearchQuery, SearchResponse, SearchResultItem, SearchHighlight
+from app.models.search import SearchQuery
+from app.services.es_batcher import batcher
+from app.services.redis_cache import cache_get, cache_set
+import asyncio
+import base64
+import hashlib
+import json
 import logging
 import os
-import re  # ADD THIS LINE
+import time
 from typing import Dict, Any, List, Optional
 from functools import lru_cache
 
 logger = logging.getLogger(__name__)
 
+# In-process result cache: repeated identical queries skip the ES round-trip
+# entirely and return the already-serialized response payload.
+_SEARCH_CACHE: TTLCache = TTLCache(maxsize=2048, ttl=60)
+# Dogpile locks live in a TTL cache bounded like the result cache, so a
+# high-cardinality query stream can't grow the lock map without limit.
+# If a lock is evicted while held, the worst case is two concurrent
+# fills of the same key — correct, just briefly uncoalesced.
+_CACHE_LOCKS: TTLCache = TTLCache(maxsize=2048, ttl=60)
+
+def _search_cache_key(search_params: SearchQuery) -> bytes:
+    """Stable fingerprint of the fields that affect search results"""
+    raw = json.dumps(
+        [
+            search_params.query,
+            search_params.page,
+            search_params.page_size,
+            search_params.filter_by,
+            search_params.sort_by,
+            search_params.sort_order,
+            search_params.cursor,
+        ],
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.blake2b(raw.encode(), digest_size=16).digest()
+
+def _get_cache_lock(key: bytes) -> asyncio.Lock:
+    """Per-key lock so concurrent identical queries coalesce to one ES call"""
+    lock = _CACHE_LOCKS.get(key)
+    if lock is None:
+        lock = asyncio.Lock()
+        _CACHE_LOCKS[key] = lock
+    return lock
+
+def clear_search_cache() -> int:
+    """Clear the search result cache and return how many entries were dropped"""
+    count = len(_SEARCH_CACHE)
+    _SEARCH_CACHE.clear()
+    _CACHE_LOCKS.clear()
+    return count
+
 # Configure Elasticsearch client options
 @lru_cache()
 
-def get_elasticsearch_client() -> Elasticsearch:
-    """Get or create an Elasticsearch client"""
+def get_elasticsearch_client() -> AsyncElasticsearch:
+    """Get or create the single shared Elasticsearch client.
+
+    Never construct AsyncElasticsearch per request: each instance owns an
+    aiohttp session and connection pool, so per-request construction leaks
+    connections and defeats keep-alive. The lru_cache guarantees one
+    instance per process; request handlers receive it via get_es.
+    """
     from app.config import settings
-    
-    # Create a new client or return an existing one
-    client = Elasticsearch( settings.es_host, api_key=settings.es_apikey)
-    
+
+    # Always async: a sync client here would block the event loop for the
+    # whole ES round-trip and serialize every in-flight request.
+    # The default pool of 10 sockets per node caps concurrency and causes
+    # head-of-line blocking under load, so size it for worker concurrency;
+    # compression cuts bytes-on-wire for the large text payloads.
+    client = AsyncElasticsearch(
+        settings.es_host,
+        api_key=settings.es_apikey,
+        connections_per_node=64,
+        http_compress=True,
+        request_timeout=10,
+        retry_on_timeout=True,
+        max_retries=2,
+    )
+
     return client
 
-# Get client instance
-try:
-    es = get_elasticsearch_client()
-    logger.info("Successfully initialized Elasticsearch client")
-except Exception as e:
-    logger.error(f"Failed to initialize Elasticsearch client: {str(e)}")
-    # Re-raise the exception for proper error handling
-    raise
-    
-    es = AsyncElasticWrapper(sync_es)
-    logger.info("Using synchronous Elasticsearch client with async wrapper")
-
-def check_connection() -> bool:
-    """Check if Elasticsearch connection is successful"""
+async def get_es(request: Request) -> AsyncElasticsearch:
+    """FastAPI dependency returning the client created at app startup.
+
+    Constructing the client at import time bound it to whatever process
+    first imported the module; on serverless that meant a fresh client
+    (and fresh connections) per cold invocation. The client now lives on
+    app.state, created in the startup hook and closed on shutdown.
+    """
+    return request.app.state.es
+
+# Load balancers hit /health every few seconds; cache the ping so that
+# steady probe traffic doesn't turn into a steady stream of ES requests
+_PING_TTL_SECONDS = 5.0
+_PING_CACHE = {"ts": 0.0, "ok": False}
+_PING_LOCK = asyncio.Lock()
+
+async def check_connection() -> bool:
+    """Check if Elasticsearch connection is successful (cached for 5s)"""
+    if time.monotonic() - _PING_CACHE["ts"] < _PING_TTL_SECONDS:
+        return _PING_CACHE["ok"]
+
+    async with _PING_LOCK:
+        # Double-check: another probe may have refreshed while we waited
+        if time.monotonic() - _PING_CACHE["ts"] < _PING_TTL_SECONDS:
+            return _PING_CACHE["ok"]
+        _PING_CACHE["ok"] = await _ping()
+        _PING_CACHE["ts"] = time.monotonic()
+        return _PING_CACHE["ok"]
+
+async def _ping() -> bool:
     try:
         client = get_elasticsearch_client()
-        return client.ping()
+        # Short timeout so a stuck ES doesn't hang the health probe
+        return await client.options(request_timeout=1).ping()
     except ValueError as e:
         if "aiohttp" in str(e):
             logger.error("Missing aiohttp dependency. Make sure aiohttp is installed.")
-            return {"error": "Missing aiohttp dependency", "message": str(e)}
+            return False
         else:
             logger.error(f"Elasticsearch value error: {str(e)}")
             return False
@@ -49,94 +133,220 @@ def check_connection() -> bool:
         logger.error(f"Elasticsearch connection error: {str(e)}")
         return False
 
+# from/size pagination is O(from + size) per shard and rejected by ES past
+# this window; deeper pages go through a PIT + search_after cursor instead
+MAX_RESULT_WINDOW = 10000
+
+# Results must have at least this many sentences; enforced server-side
+# via a range filter on the indexed sentence_count field
+MIN_SENTENCES = 6
+
+# Single C-level pass for the wiki URL slug; faster than str.replace in
+# the per-hit loop
+_URL_TRANS = str.maketrans({" ": "_"})
+
+def _encode_cursor(pit_id: str, sort_values: List[Any]) -> str:
+    """Pack a PIT id and the last hit's sort values into an opaque cursor"""
+    return base64.urlsafe_b64encode(
+        json.dumps([pit_id, sort_values]).encode()
+    ).decode()
+
+def _decode_cursor(cursor: str) -> tuple:
+    """Unpack an opaque cursor into (pit_id, sort_values)"""
+    pit_id, sort_values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    return pit_id, sort_values
+
+# Static sub-structures of the query body. These never change between
+# requests, so they are built once and shared (never mutated) instead of
+# being re-allocated on every call.
+# comment is not in the index mapping, and boost 1 is the default anyway,
+# so scoring only runs over the two real fields
+_MULTI_MATCH_FIELDS = ["title^3", "text^2"]
+
+_HIGHLIGHT_CONFIG = {
+    "fields": {
+        "title": {"number_of_fragments": 1},
+        "text": {"number_of_fragments": 1, "fragment_size": 150}
+    },
+    "pre_tags": ["<mark>"],
+    "post_tags": ["</mark>"]
+}
+
+# Only the fields the response payload reads; keeps the full text body,
+# dense vectors and any other stored fields out of the hit _source
+_SOURCE_INCLUDES = {"includes": ["title", "contributor_username", "timestamp"]}
+
+# The UI only renders a snippet, so ES truncates the text server-side via
+# a runtime field instead of shipping tens of KB per hit over the wire
+_TEXT_PREVIEW_RUNTIME = {
+    "text_preview": {
+        "type": "keyword",
+        "script": {
+            "source": (
+                "emit(params._source.text == null ? '' : "
+                "params._source.text.substring(0, "
+                "(int) Math.min(500, params._source.text.length())))"
+            )
+        }
+    }
+}
+
+_TITLE_SUGGEST_CONFIG = {
+    "term": {
+        "field": "title",
+        "suggest_mode": "popular",
+        "sort": "frequency"
+    }
+}
+
+@lru_cache(maxsize=32)
+def _sort_template(sort_by: str, sort_order: str) -> tuple:
+    """Memoized sort clause for a (field, order) pair"""
+    return ({sort_by: {"order": sort_order}},)
+
 def _build_elasticsearch_query(search_params: SearchQuery) -> Dict[str, Any]:
     """Build Elasticsearch query from search parameters"""
     # Calculate pagination
     from_val = (search_params.page - 1) * search_params.page_size
-    
-    # Base query
+
+    multi_match = {
+        "query": search_params.query,
+        "fields": _MULTI_MATCH_FIELDS,
+        "operator": "or"
+    }
+
+    # Fuzzy expansion multiplies the terms scored per shard; only enable
+    # it for short single-word queries where typos actually matter
+    q_text = search_params.query.strip()
+    if 4 <= len(q_text) <= 20 and " " not in q_text:
+        multi_match["fuzziness"] = "AUTO"
+
+    # Base query: only the parts that vary per request are allocated here.
+    # _source is limited to the fields the response actually uses, so ES
+    # never ships embeddings or other stored fields over the wire.
     query = {
         "from": from_val,
         "size": search_params.page_size,
-        "query": {
-            "multi_match": {
-                "query": search_params.query,
-                "fields": ["title^3", "text^2", "comment^1"],
-                "fuzziness": "AUTO",
-                "operator": "or"
-            }
-        },
-        "highlight": {
-            "fields": {
-                "title": {"number_of_fragments": 1},
-                "text": {"number_of_fragments": 1, "fragment_size": 150}
-            },
-            "pre_tags": ["<mark>"],
-            "post_tags": ["</mark>"]
-        }
+        "query": {"multi_match": multi_match},
+        "highlight": _HIGHLIGHT_CONFIG,
+        "_source": _SOURCE_INCLUDES,
+        "runtime_mappings": _TEXT_PREVIEW_RUNTIME,
+        "fields": ["text_preview"]
     }
-    
+
+    # Quality gate pushed down to ES: only docs with enough sentences are
+    # returned, so no over-fetching or Python-side filtering is needed and
+    # total/pagination stay correct. sentence_count is written at index
+    # time by the ingestion scripts.
+    filter_clauses = [{"range": {"sentence_count": {"gte": MIN_SENTENCES}}}]
+
     # Add filtering if present
     if search_params.filter_by:
-        filter_clauses = []
         for field, value in search_params.filter_by.items():
             if isinstance(value, list):
                 filter_clauses.append({"terms": {field: value}})
             else:
                 filter_clauses.append({"term": {field: value}})
-        
-        query["query"] = {
-            "bool": {
-                "must": query["query"],
-                "filter": filter_clauses
-            }
+
+    query["query"] = {
+        "bool": {
+            "must": query["query"],
+            "filter": filter_clauses
         }
-    
-    # Add sorting if specified
+    }
+
+    # Add sorting if specified (cached clause; copied before any mutation)
     if search_params.sort_by:
-        query["sort"] = [{search_params.sort_by: {"order": search_params.sort_order}}]
-    
-    # Add suggestions
+        query["sort"] = list(_sort_template(search_params.sort_by, search_params.sort_order))
+
+    # Deep pagination: swap from/size for a PIT + search_after cursor, which
+    # is O(page_size) per shard regardless of depth
+    if search_params.pit_id:
+        del query["from"]
+        query["pit"] = {"id": search_params.pit_id, "keep_alive": "1m"}
+        sort = query.get("sort", [{"_score": "desc"}])
+        sort.append({"_shard_doc": "asc"})
+        query["sort"] = sort
+        if search_params.search_after:
+            query["search_after"] = search_params.search_after
+
+    # Add suggestions (static config shared across requests)
     query["suggest"] = {
         "text": search_params.query,
-        "title_suggestions": {
-            "term": {
-                "field": "title",
-                "suggest_mode": "popular",
-                "sort": "frequency"
-            }
-        }
+        "title_suggestions": _TITLE_SUGGEST_CONFIG
     }
-    
+
     return query
-import re  # ADD THIS IMPORT AT THE TOP
-
-def count_sentences(text: str) -> int:
-    """Count sentences in text"""
-    if not text:
-        return 0
-    
-    # Split by sentence endings and filter out empty strings
-    sentences = re.split(r'[.!?]+', text.strip())
-    sentences = [s.strip() for s in sentences if s.strip()]
-    return len(sentences)
-
-def search(search_params: SearchQuery) -> SearchResponse:
+async def search(search_params: SearchQuery, es: AsyncElasticsearch) -> Dict[str, Any]:
     """Execute search against Elasticsearch"""
+    cache_key = _search_cache_key(search_params)
+
+    # Fast path: repeated query within the TTL window
+    cached = _SEARCH_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
+
+    # First-page unfiltered queries are the hot, highly skewed traffic;
+    # those also get the shared Redis L2 so warm results survive across
+    # serverless instances
+    use_l2 = (
+        search_params.page == 1
+        and not search_params.filter_by
+        and not search_params.cursor
+    )
+    l2_key = b"search:" + cache_key
+
+    # Dogpile guard: concurrent identical queries wait for one ES call
+    async with _get_cache_lock(cache_key):
+        cached = _SEARCH_CACHE.get(cache_key)
+        if cached is not None:
+            return cached
+        if use_l2:
+            cached = await cache_get(l2_key)
+            if cached is not None:
+                _SEARCH_CACHE[cache_key] = cached
+                return cached
+        response = await _execute_search(search_params, es)
+        _SEARCH_CACHE[cache_key] = response
+        if use_l2:
+            await cache_set(l2_key, response, ttl_seconds=60)
+        return response
+
+async def _execute_search(search_params: SearchQuery, es: AsyncElasticsearch) -> Dict[str, Any]:
+    """Run the search against Elasticsearch (cache miss path)"""
     try:
-        # Get the Elasticsearch client
-        client = get_elasticsearch_client()
-        
-        # Build the query - GET MORE RESULTS TO FILTER FROM
+        # Resolve a deep-pagination cursor into its PIT + search_after parts,
+        # or reject page jumps that from/size can't reach
+        if search_params.cursor:
+            search_params.pit_id, search_params.search_after = _decode_cursor(
+                search_params.cursor
+            )
+        elif search_params.page * search_params.page_size > MAX_RESULT_WINDOW:
+            # A direct jump this deep can't be served: ES caps from+size
+            # at the result window, and a PIT without a search_after
+            # position would silently return the first page. Deep result
+            # sets are walked page by page via next_cursor.
+            raise HTTPException(
+                status_code=400,
+                detail=(
+                    f"page * page_size may not exceed {MAX_RESULT_WINDOW}; "
+                    "follow next_cursor from earlier pages to go deeper"
+                ),
+            )
+
+        # Build the query; the sentence-count gate runs inside ES so
+        # exactly page_size matching docs come back
         query = _build_elasticsearch_query(search_params)
-        
-        # Increase size to get more results for filtering
-        original_size = query["size"]
-        query["size"] = min(100, original_size * 10)  # Get 10x more results or 100 max
-        
-        # Execute the search
-        response = client.search(index=settings.es_index, body=query)
-        
+
+        if search_params.pit_id:
+            # PIT queries carry their own index context, so they can't share
+            # the batcher's per-line index header; send them directly
+            response = await es.search(body=query)
+        else:
+            # Execute the search through the msearch batcher, which coalesces
+            # concurrent queries into a single _msearch round-trip
+            response = await batcher.submit(query)
+
         # Process results
         hits = response["hits"]["hits"]
         total = response["hits"]["total"]["value"]
@@ -148,58 +358,55 @@ def search(search_params: SearchQuery) -> SearchResponse:
                 for option in suggestion_list["options"]:
                     suggestions.append(option["text"])
         
-        # Format ALL results first
-        all_results = []
+        # Format results. ES is a trusted internal source, so results are
+        # built as plain dicts ready for orjson serialization instead of
+        # going through model construction plus .dict() calls.
+        final_results = []
         for hit in hits:
             source = hit["_source"]
-            highlights = {}
-            
+            title = source.get("title", "")
+            timestamp = source.get("timestamp", "")
+
+            # Server-side preview; fall back to _source for older queries
+            preview = hit.get("fields", {}).get("text_preview")
+            full_text = preview[0] if preview else source.get("text", "")
+
+            item = {
+                "id": hit["_id"],
+                "title": title,
+                "text": full_text,
+                "description": full_text,  # Matches frontend expectations
+                "contributor": source.get("contributor_username", ""),
+                "timestamp": timestamp,
+                "createdAt": timestamp,  # Mapping timestamp to createdAt
+                "score": hit["_score"],
+                "url": f"https://en.wikipedia.org/wiki/{title.translate(_URL_TRANS)}"
+            }
+
             if "highlight" in hit:
-                if "title" in hit["highlight"]:
-                    highlights["title"] = hit["highlight"]["title"]
-                if "text" in hit["highlight"]:
-                    highlights["text"] = hit["highlight"]["text"]
-            
-            highlight_obj = SearchHighlight(
-                title=highlights.get("title"),
-                text=highlights.get("text")
-            ) if highlights else None
-            
-            # Keep full text for sentence counting
-            full_text = source.get("text", "")
-            
-            all_results.append(
-                SearchResultItem(
-                    id=hit["_id"],
-                    title=source.get("title", ""),
-                    text=full_text,  # Keep full text
-                    contributor=source.get("contributor_username", ""),
-                    timestamp=source.get("timestamp", ""),
-                    score=hit["_score"],
-                    highlights=highlight_obj,
-                    url=f"https://en.wikipedia.org/wiki/{source.get('title', '').replace(' ', '_')}"
-                )
+                item["highlights"] = {
+                    "title": hit["highlight"].get("title"),
+                    "text": hit["highlight"].get("text")
+                }
+
+            final_results.append(item)
+
+        payload = {
+            "total": total,  # The filter runs in ES, so the count is exact
+            "page": search_params.page,
+            "page_size": search_params.page_size,
+            "results": final_results,
+            "suggest": suggestions if suggestions else None
+        }
+
+        # Hand the client an opaque cursor for the next page of a PIT walk
+        if search_params.pit_id and hits:
+            payload["next_cursor"] = _encode_cursor(
+                response.get("pit_id", search_params.pit_id),
+                hits[-1]["sort"],
             )
-        
-        # FILTER: Only keep results with 6+ sentences
-        filtered_results = []
-        for result in all_results:
-            sentence_count = count_sentences(result.text)
-            if sentence_count >= 6:
-                filtered_results.append(result)
-        
-        # Sort by score (descending) and take top 10
-        filtered_results.sort(key=lambda x: x.score, reverse=True)
-        final_results = filtered_results[:search_params.page_size]
-        
-        return SearchResponse(
-            total=len(final_results),  # Return filtered count
-            page=search_params.page,
-            page_size=search_params.page_size,
-            results=final_results,
-            suggest=suggestions if suggestions else None
-        )
-        
+        return payload
+
     # Update the exception handling to use the new exception classes    
     except (ApiError, TransportError) as e:
         logger.error(f"Elasticsearch search error: {str(e)}")
@@ -0,0 +1,119 @@
+# filename: app/services/es_batcher.py
+import asyncio
+import logging
+from typing import Any, Dict, List, Tuple
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Micro-batching window: queries arriving within this window are sent to
+# Elasticsearch as one _msearch request instead of N separate round-trips
+MAX_WAIT_SECONDS = 0.008
+MAX_BATCH_SIZE = 32
+
+class ESBatcher:
+    """Coalesces concurrent search queries into a single _msearch call.
+
+    Each caller submits its query body and awaits a Future; a single
+    background task drains the queue, dispatches one msearch request and
+    fans the per-query responses back to the waiting callers.
+    """
+
+    def __init__(self):
+        self._queue: asyncio.Queue = None
+        self._task: asyncio.Task = None
+        self._loop: asyncio.AbstractEventLoop = None
+
+    def start(self):
+        """Start the background dispatch task (call from app startup)"""
+        self._ensure_running()
+
+    async def stop(self):
+        """Cancel the background task (call from app shutdown)"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self._queue = None
+            self._loop = None
+
+    async def submit(self, query_body: Dict[str, Any]) -> Dict[str, Any]:
+        """Submit one query body and wait for its individual response"""
+        self._ensure_running()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((query_body, future))
+        return await future
+
+    def _ensure_running(self):
+        # Lazy (re)start so warm serverless containers recover if the
+        # loop was recycled between invocations. A task abandoned on a
+        # torn-down loop never reports done(), so compare the running
+        # loop against the one the task was created on and rebuild the
+        # queue and task whenever it changed.
+        loop = asyncio.get_event_loop()
+        if self._task is None or self._task.done() or loop is not self._loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._task = loop.create_task(self._run())
+            logger.info("Started Elasticsearch msearch batcher task")
+
+    async def _drain(self) -> List[Tuple[Dict[str, Any], asyncio.Future]]:
+        """Collect queries until the batch is full or the window closes"""
+        loop = asyncio.get_running_loop()
+        items = [await self._queue.get()]
+        deadline = loop.time() + MAX_WAIT_SECONDS
+        while len(items) < MAX_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                items.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return items
+
+    async def _run(self):
+        while True:
+            items = await self._drain()
+            try:
+                responses = await self._dispatch([query for query, _ in items])
+                for (_, future), response in zip(items, responses):
+                    if future.done():
+                        continue
+                    if "error" in response:
+                        future.set_exception(
+                            RuntimeError(f"msearch item failed: {response['error']}")
+                        )
+                    else:
+                        future.set_result(response)
+            except asyncio.CancelledError:
+                for _, future in items:
+                    if not future.done():
+                        future.cancel()
+                raise
+            except Exception as e:
+                logger.error(f"msearch batch failed: {str(e)}")
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+
+    async def _dispatch(self, queries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Send one _msearch request covering all queries in the batch"""
+        # Imported here to avoid a circular import with the search service
+        from app.services.elasticsearch import get_elasticsearch_client
+
+        client = get_elasticsearch_client()
+        searches = []
+        for query in queries:
+            searches.append({"index": settings.es_index})
+            searches.append(query)
+
+        response = await client.msearch(searches=searches)
+        return response["responses"]
+
+# Shared batcher instance used by the search service
+batcher = ESBatcher()
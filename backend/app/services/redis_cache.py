@@ -0,0 +1,62 @@
+# filename: app/services/redis_cache.py
+import logging
+from typing import Any, Optional
+
+import orjson
+import redis.asyncio as redis
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Shared L2 cache. The in-process TTL cache only helps within one warm
+# container; Redis (e.g. Upstash from Vercel) is shared across instances,
+# so hot queries and suggestion prefixes are served without touching ES
+# even right after a cold start.
+_redis_client: Optional[redis.Redis] = None
+
+def get_redis() -> Optional[redis.Redis]:
+    """Get the shared Redis client, or None when REDIS_URL is not set"""
+    global _redis_client
+    if not settings.redis_url:
+        return None
+    if _redis_client is None:
+        try:
+            _redis_client = redis.from_url(settings.redis_url, decode_responses=False)
+            logger.info("Initialized Redis cache client")
+        except Exception as e:
+            logger.error(f"Failed to initialize Redis client: {str(e)}")
+            return None
+    return _redis_client
+
+async def cache_get(key: bytes) -> Optional[Any]:
+    """Fetch and deserialize a cached value; None on miss or Redis error"""
+    client = get_redis()
+    if client is None:
+        return None
+    try:
+        raw = await client.get(key)
+        return orjson.loads(raw) if raw is not None else None
+    except Exception as e:
+        logger.warning(f"Redis get failed: {str(e)}")
+        return None
+
+async def cache_set(key: bytes, value: Any, ttl_seconds: int) -> None:
+    """Serialize and store a value with a TTL; errors are logged, not raised"""
+    client = get_redis()
+    if client is None:
+        return
+    try:
+        await client.setex(key, ttl_seconds, orjson.dumps(value))
+    except Exception as e:
+        logger.warning(f"Redis set failed: {str(e)}")
+
+async def close_redis() -> None:
+    """Close the shared Redis client (call from app shutdown)"""
+    global _redis_client
+    if _redis_client is not None:
+        try:
+            await _redis_client.close()
+        except Exception as e:
+            logger.warning(f"Redis close failed: {str(e)}")
+        _redis_client = None
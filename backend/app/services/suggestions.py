@@ -1,20 +1,49 @@
 from app.models.suggestions import SuggestionQuery, SuggestionResponse
 from app.services.elasticsearch import get_elasticsearch_client
-from elasticsearch import Elasticsearch  # Use regular Elasticsearch instead of AsyncElasticsearch
-from typing import List, Set
+from app.services.redis_cache import cache_get, cache_set
+from elasticsearch import AsyncElasticsearch
+from typing import List, Optional
 import logging
+import time
+
+import pygtrie
 
 from app.config import settings
 
 logger = logging.getLogger(__name__)
 
-async def get_suggestions(query: SuggestionQuery) -> SuggestionResponse:
+# In-process prefix trie: the first few keystrokes of popular queries are
+# served straight from memory without leaving the process. Entries carry
+# a timestamp so stale prefixes fall back to ES after the TTL.
+_PREFIX_TRIE = pygtrie.CharTrie()
+_TRIE_TTL_SECONDS = 600
+_TRIE_MAX_ENTRIES = 10000
+
+def _trie_get(prefix: str) -> Optional[List[str]]:
+    """Look up suggestions for a prefix; None on miss or expired entry"""
+    entry = _PREFIX_TRIE.get(prefix)
+    if entry is None:
+        return None
+    stored_at, suggestions = entry
+    if time.monotonic() - stored_at > _TRIE_TTL_SECONDS:
+        del _PREFIX_TRIE[prefix]
+        return None
+    return suggestions
+
+def _trie_set(prefix: str, suggestions: List[str]) -> None:
+    """Remember suggestions for a prefix, capping total trie size"""
+    if len(_PREFIX_TRIE) >= _TRIE_MAX_ENTRIES:
+        _PREFIX_TRIE.clear()
+    _PREFIX_TRIE[prefix] = (time.monotonic(), suggestions)
+
+async def get_suggestions(query: SuggestionQuery, es_client: AsyncElasticsearch = None) -> SuggestionResponse:
     """
     Get search suggestions based on user input
-    
+
     Args:
         query: SuggestionQuery object with the query and parameters
-        
+        es_client: Elasticsearch client (falls back to the shared one)
+
     Returns:
         SuggestionResponse with list of suggestions
     """
@@ -25,13 +54,37 @@ async def get_suggestions(query: SuggestionQuery) -> SuggestionResponse:
             suggestions=[]
         )
     
+    # Normalize the prefix once; it keys both cache tiers below. The
+    # completion suggester only returns max_suggestions options, so the
+    # requested size must be part of the key — otherwise a small request
+    # would populate the cache with a short list that then gets served
+    # to larger requests
+    prefix = query.query.strip().lower()
+    trie_key = f"{query.max_suggestions}:{prefix}"
+
+    # Hot prefixes are answered from the in-process trie without any I/O
+    trie_suggestions = _trie_get(trie_key)
+    if trie_suggestions is not None:
+        return SuggestionResponse(
+            success=True,
+            suggestions=trie_suggestions[:query.max_suggestions]
+        )
+
+    # Suggestion traffic is dominated by short, repeated prefixes, so a
+    # shared Redis cache absorbs most autocomplete requests across instances
+    l2_key = f"sugg:{query.max_suggestions}:{prefix[:32]}".encode()
+    cached = await cache_get(l2_key)
+    if cached is not None:
+        return SuggestionResponse(**cached)
+
     try:
-        # Get Elasticsearch client
-        es_client = get_elasticsearch_client()  # Remove await here
-        
+        # Fall back to the shared client when no injected one was given
+        if es_client is None:
+            es_client = get_elasticsearch_client()
+
         # Try to get suggestions using different methods
-        suggestions = _get_elasticsearch_suggestions(es_client, query)  # Remove await here
-        
+        suggestions = await _get_elasticsearch_suggestions(es_client, query)
+
         # If we couldn't get any suggestions from ES, use static fallback
         if not suggestions:
             suggestions = _get_static_suggestions(query.query)
@@ -41,11 +94,15 @@ async def get_suggestions(query: SuggestionQuery) -> SuggestionResponse:
                 is_static=True
             )
             
-        return SuggestionResponse(
+        result = SuggestionResponse(
             success=True,
             suggestions=suggestions[:query.max_suggestions]
         )
-        
+        # Only dynamic, successful results are worth sharing across instances
+        _trie_set(trie_key, suggestions)
+        await cache_set(l2_key, result.model_dump(), ttl_seconds=300)
+        return result
+
     except Exception as e:
         logger.error(f"Error getting suggestions: {str(e)}")
         
@@ -58,143 +115,65 @@ async def get_suggestions(query: SuggestionQuery) -> SuggestionResponse:
             message="Used fallback suggestions due to an error"
         )
 
-# Remove async from this function
-def _get_elasticsearch_suggestions(
-    es_client: Elasticsearch, 
+async def _get_elasticsearch_suggestions(
+    es_client: AsyncElasticsearch,
     query: SuggestionQuery
 ) -> List[str]:
-    """Get suggestions using Elasticsearch"""
+    """Get suggestions from the completion suggester.
+
+    A single FST lookup on the title.suggest completion subfield returns
+    a length-bounded, prefix-ranked list; no aggregations, no Python set
+    accumulation and no O(N log N) re-sort. Fuzzy matching covers typos.
+    Index existence is verified once at app startup, not per request.
+    """
     q = query.query.strip().lower()
-    all_suggestions: Set[str] = set()
-    index_name = settings.es_index
-    
+
     try:
-        # Debug: Check if index exists
-        if not es_client.indices.exists(index=index_name):
-            logger.error(f"Index {index_name} does not exist")
-            return []
-        
-        # 1. Try a simple search to confirm connectivity
-        test_response = es_client.search(
-            index=index_name,
-            body={
-                "size": 1,
-                "query": {
-                    "match_all": {}
-                }
-            }
-        )
-        
-        # Debug the test response
-        logger.info(f"Test search found {test_response['hits']['total']['value']} documents")
-        
-        # 2. Try prefix query with explicit index - FIXED aggregation on text field
-        # Instead of using aggregations on text field, use only title.keyword
-        prefix_response = es_client.search(
-            index=index_name,
+        response = await es_client.search(
+            index=settings.es_index,
             body={
-                "size": 0,
-                "query": {
-                    "bool": {
-                        "should": [
-                            {"prefix": {"title": {"value": q, "boost": 2.0}}},
-                            {"match_phrase_prefix": {"text": {"query": q, "slop": 2}}}
-                        ]
-                    }
-                },
-                "aggs": {
-                    "title_suggestions": {
-                        "terms": {
-                            "field": "title.keyword",
-                            "size": 5
+                "suggest": {
+                    "title_completions": {
+                        "prefix": q,
+                        "completion": {
+                            "field": "title.suggest",
+                            "size": query.max_suggestions,
+                            "skip_duplicates": True,
+                            "fuzzy": {"fuzziness": "AUTO"}
                         }
                     }
-                    # Removed the text_terms aggregation that was causing the error
-                }
-            }
-        )
-        
-        # Extract title suggestions
-        if "aggregations" in prefix_response and "title_suggestions" in prefix_response["aggregations"]:
-            buckets = prefix_response["aggregations"]["title_suggestions"]["buckets"]
-            logger.info(f"Found {len(buckets)} title suggestion buckets")
-            
-            for bucket in buckets:
-                all_suggestions.add(bucket["key"])
-        
-        # 3. Use a direct search approach for text field matches instead of aggregations
-        # This approach doesn't require fielddata
-        direct_response = es_client.search(
-            index=index_name,
-            body={
-                "size": 10,
-                "query": {
-                    "bool": {
-                        "should": [
-                            {"prefix": {"title": q}},
-                            {"match": {"title": {"query": q, "fuzziness": "AUTO"}}},
-                            # Add specific queries for the text field that don't require aggregations
-                            {"match_phrase_prefix": {"text": {"query": q, "slop": 3}}},
-                            {"match": {"text": {"query": q, "fuzziness": "AUTO", "operator": "AND"}}}
-                        ]
-                    }
                 },
-                "_source": ["title"]  # Just get the title field
+                "_source": False
             }
         )
-        
-        # Extract direct matches
-        if "hits" in direct_response and "hits" in direct_response["hits"]:
-            hits = direct_response["hits"]["hits"]
-            logger.info(f"Direct search found {len(hits)} matching documents")
-            
-            for hit in hits:
-                if "_source" in hit and "title" in hit["_source"]:
-                    all_suggestions.add(hit["_source"]["title"])
-        
     except Exception as e:
         logger.error(f"Error in Elasticsearch suggestions: {str(e)}", exc_info=True)
-    
-    # Log the suggestions found
-    logger.info(f"Found {len(all_suggestions)} dynamic suggestions from Elasticsearch")
-    
-    # Add some variations to the suggestions
-    variations = [
-        f"{q} definition",
-        f"{q} examples",
-        f"{q} tutorial",
-        f"what is {q}"
-    ]
-    
-    for variation in variations:
-        all_suggestions.add(variation)
-    
-    # Filter out suggestions that are identical to the query
-    filtered_suggestions = [s for s in all_suggestions if s.lower() != q]
-    
-    # Sort suggestions (prioritize those that start with the query)
-    sorted_suggestions = sorted(
-        filtered_suggestions,
-        key=lambda s: (0 if s.lower().startswith(q) else 1, len(s))
-    )
-    
-    return sorted_suggestions
+        return []
+
+    suggestions = []
+    for entry in response["suggest"]["title_completions"]:
+        for option in entry["options"]:
+            if option["text"].lower() != q:
+                suggestions.append(option["text"])
+
+    logger.info(f"Found {len(suggestions)} dynamic suggestions from Elasticsearch")
+    return suggestions
+
+# Common search variations, kept as format templates so each call only
+# pays for the substitutions. Every template adds text around the query,
+# so no variation can ever equal the query itself — no filter needed.
+_STATIC_VARIATIONS = (
+    "%s definition",
+    "%s examples",
+    "%s tutorial",
+    "what is %s",
+    "%s guide",
+    "%s vs",
+    "learn %s",
+    "%s best practices",
+)
 
 def _get_static_suggestions(query: str) -> List[str]:
     """Generate static suggestions based on the query"""
     q = query.strip().lower()
-    
-    # Some common search variations
-    variations = [
-        f"{q} definition",
-        f"{q} examples",
-        f"{q} tutorial",
-        f"what is {q}",
-        f"{q} guide",
-        f"{q} vs",
-        f"learn {q}",
-        f"{q} best practices"
-    ]
-    
-    # Filter out variations that are identical to the query
-    return [v for v in variations if v.lower() != q]
\ No newline at end of file
+    return [t % q for t in _STATIC_VARIATIONS]
\ No newline at end of file